@@ -1,20 +1,38 @@
 #!/usr/bin/env python3
 
+import ctypes
+import grp
 import logging
 import os
+import pwd
+import re
+import secrets
+import shlex
 import shutil
 import stat
 import subprocess
+import threading
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import date
 from itertools import chain
 from pathlib import Path
-from random import choices
-from string import ascii_lowercase, digits
 from types import MappingProxyType
-from typing import Iterator, Literal, Mapping, Optional, Sequence, Union
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 # The following class definitions here are not the installation configuration!
 # Scroll down to section "Configuration".
@@ -27,8 +45,21 @@ class ZfsPool:
     mountpoint: Union[Path, Literal["none", "legacy"], None] = None
     kind: str = "single"
     password: str = ""
-    pool_properties: Mapping[str, str] = field(default_factory=dict)
-    file_system_properties: Mapping[str, str] = field(default_factory=dict)
+    pool_properties: Sequence[Tuple[str, str]] = ()
+    file_system_properties: Sequence[Tuple[str, str]] = ()
+    _pool_property_args: Tuple[str, ...] = field(init=False, repr=False)
+    _file_system_property_args: Tuple[str, ...] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # Arguments for "zpool create", for example: ("-o", "ashift=12", ...).
+        self._pool_property_args = tuple(
+            chain.from_iterable(("-o", f"{k}={v}") for k, v in self.pool_properties)
+        )
+        self._file_system_property_args = tuple(
+            chain.from_iterable(
+                ("-O", f"{k}={v}") for k, v in self.file_system_properties
+            )
+        )
 
 
 @dataclass
@@ -88,19 +119,19 @@ CONFIG = Config(
         ],
         kind="single",  # Use "mirror", "raidz1", "raidz2", etc. for more than one disk.
         password="change this pass",  # Empty string means unencrypted pool.
-        pool_properties={
-            "ashift": "13",
-            "autotrim": "on",
-        },
-        file_system_properties={
-            "acltype": "posixacl",
-            "compression": "zstd",
-            "dnodesize": "auto",
-            "normalization": "formD",
-            "utf8only": "on",
-            "relatime": "on",
-            "xattr": "sa",
-        },
+        pool_properties=(
+            ("ashift", "13"),
+            ("autotrim", "on"),
+        ),
+        file_system_properties=(
+            ("acltype", "posixacl"),
+            ("compression", "zstd"),
+            ("dnodesize", "auto"),
+            ("normalization", "formD"),
+            ("utf8only", "on"),
+            ("relatime", "on"),
+            ("xattr", "sa"),
+        ),
     ),
     #
     # Other ZFS pools to set up. Zero to arbitrary many pools may be configured. Each
@@ -116,19 +147,19 @@ CONFIG = Config(
             ],
             kind="mirror",
             password="change this pass",
-            pool_properties={
-                "ashift": "12",
-                "autotrim": "on",
-            },
-            file_system_properties={
-                "acltype": "posixacl",
-                "compression": "zstd",
-                "dnodesize": "auto",
-                "normalization": "formD",
-                "utf8only": "on",
-                "relatime": "on",
-                "xattr": "sa",
-            },
+            pool_properties=(
+                ("ashift", "12"),
+                ("autotrim", "on"),
+            ),
+            file_system_properties=(
+                ("acltype", "posixacl"),
+                ("compression", "zstd"),
+                ("dnodesize", "auto"),
+                ("normalization", "formD"),
+                ("utf8only", "on"),
+                ("relatime", "on"),
+                ("xattr", "sa"),
+            ),
         ),
     ],
     #
@@ -188,8 +219,30 @@ CONFIG = Config(
 
 
 LOGGER = logging.getLogger(__name__)
+# Bound once since all primitives below check it on every call.
+DRY_MODE = CONFIG.dry_mode
 CONFIG_POOLS = (CONFIG.root_pool, *CONFIG.data_pools)
 NEW_SYSTEM_ROOT = Path("/rpool")
+# For example: "en_US.UTF-8" -> "en".
+LOCALE_LANG = CONFIG.locale[: CONFIG.locale.index("_")]
+NEW_SYSTEM_PACKAGES = (
+    "@core",
+    "kernel",
+    "kernel-devel",
+    "kexec-tools",
+    "efibootmgr",
+    "glibc-minimal-langpack",
+    f"glibc-langpack-{LOCALE_LANG}",
+    "zfs",
+    "zfs-dracut",
+    *CONFIG.packages,
+)
+# Flags for the mount(2) and umount2(2) system calls, see "man 2 mount".
+MS_BIND = 4096
+MS_REC = 16384
+MNT_DETACH = 2
+LIBC = ctypes.CDLL("libc.so.6", use_errno=True)
+ZFS_LIST_CACHER_PROPS_RE = re.compile(rb'^PROPS="([^"]*)"', re.MULTILINE)
 
 
 def main() -> None:
@@ -217,7 +270,7 @@ def main() -> None:
 
     for rbind_dir in ("dev", "proc", "sys"):
         mkdir(NEW_SYSTEM_ROOT / rbind_dir)
-        sys("mount", "--rbind", f"/{rbind_dir}", str(NEW_SYSTEM_ROOT / rbind_dir))
+        mount_rbind(Path("/") / rbind_dir, NEW_SYSTEM_ROOT / rbind_dir)
 
     install_packages(version_id)
 
@@ -249,39 +302,47 @@ def main() -> None:
         f"{CONFIG.root_pool.name}@{date.today():%Y%m%d}-before-first-boot",
     )
 
-    sys("umount", "--recursive", "--lazy", str(NEW_SYSTEM_ROOT))
+    umount_lazy(NEW_SYSTEM_ROOT)
     sleep(10)
     sys("zpool", "export", "-a")
 
 
 def check_config_for_errors() -> None:
-    seen_pool_names = set()
-    seen_disks = set()
-    for pool in CONFIG_POOLS:
-        if pool.name in seen_pool_names:
-            raise Exception(f"Name '{pool.name}' configured for multiple pools.")
-        seen_pool_names.add(pool.name)
+    duplicate_pool_names = _duplicates(pool.name for pool in CONFIG_POOLS)
+    if duplicate_pool_names:
+        raise ValueError(
+            f"Names configured for multiple pools: {', '.join(duplicate_pool_names)}."
+        )
+
+    duplicate_disks = _duplicates(
+        str(disk) for disk in chain.from_iterable(pool.disks for pool in CONFIG_POOLS)
+    )
+    if duplicate_disks:
+        raise ValueError(
+            f"Disks configured multiple times: {', '.join(duplicate_disks)}."
+        )
 
+    duplicate_user_names = _duplicates(user.name for user in CONFIG.users)
+    if duplicate_user_names:
+        raise ValueError(
+            f"Names configured for multiple users: {', '.join(duplicate_user_names)}."
+        )
+
+    for pool in CONFIG_POOLS:
         if not pool.disks:
-            raise Exception(f"Pool {pool.name} configured without disks.")
+            raise ValueError(f"Pool {pool.name} configured without disks.")
         elif pool.kind == "single" and len(pool.disks) > 1:
-            raise Exception(
+            raise ValueError(
                 f"Pool {pool.name} kind 'single' configured with more than one disk."
             )
         elif pool.kind != "single" and len(pool.disks) == 1:
-            raise Exception(
+            raise ValueError(
                 f"Pool {pool.name} kind '{pool.kind}' configured with only one disk."
             )
-        for disk in pool.disks:
-            if disk in seen_disks:
-                raise Exception(f"Disk '{disk}' configured multiple times.")
-            seen_disks.add(disk)
 
-    seen_user_names = set()
-    for user in CONFIG.users:
-        if user.name in seen_user_names:
-            raise Exception(f"Name '{user.name}' configured for multiple users.")
-        seen_user_names.add(user.name)
+
+def _duplicates(values: Iterable[str]) -> Sequence[str]:
+    return [value for value, count in Counter(values).items() if count > 1]
 
 
 def install_zfs_to_live_environment(version_id: int) -> None:
@@ -300,43 +361,39 @@ def install_zfs_to_live_environment(version_id: int) -> None:
 
 
 def blkdiscard_and_zero_disks() -> None:
-    for pool in CONFIG_POOLS:
-        for disk in pool.disks:
-            # For a discussion of blkdiscard vs wipefs vs dd zeros, see:
-            # https://flaterco.com/kb/clearpt.html
-            sys("blkdiscard", "--force", str(disk))
-            if CONFIG.zero_disks:
-                sys(
-                    *("dd", "if=/dev/zero", f"of={disk}", "bs=4096", "status=progress"),
-                    ignore_exit_code=False,
-                )
+    disks = [disk for pool in CONFIG_POOLS for disk in pool.disks]
+    # For a discussion of blkdiscard vs wipefs vs dd zeros, see:
+    # https://flaterco.com/kb/clearpt.html
+    sys_parallel([("blkdiscard", "--force", str(disk)) for disk in disks])
+    if CONFIG.zero_disks:
+        sys_parallel(
+            [
+                ("dd", "if=/dev/zero", f"of={disk}", "bs=4096", "status=progress")
+                for disk in disks
+            ],
+            ignore_exit_code=False,
+        )
 
 
 def partition_root_pool_disks() -> None:
-    for disk in CONFIG.root_pool.disks:
-        sys("sgdisk", "--zap-all", str(disk))
-        sys(
-            "sgdisk",
-            "--new=0:1M:+512M",
-            "--typecode=0:EF00",
-            "--change-name=0:EFI System Partition",
-            str(disk),
-        )
-        if CONFIG.swap_size:
-            sys(
-                "sgdisk",
-                f"--new=0:0:+{CONFIG.swap_size}",
-                "--typecode=0:8200",
-                "--change-name=0:Swap",
-                str(disk),
-            )
-        sys(
-            "sgdisk",
-            "--new=0:0:0",
-            "--typecode=0:BF00",
-            f"--change-name=0:ZFS Pool {CONFIG.root_pool.name}",
-            str(disk),
-        )
+    # All partitions of a disk are created with a single sgdisk call and all disks are
+    # partitioned concurrently. Partition numbers are given explicitly so that the
+    # layout is unambiguous. We use "--clear" instead of "--zap-all" since the latter
+    # makes sgdisk exit without processing any further options (the disks have just
+    # been blkdiscard'ed anyways).
+    sgdisk_args = ["sgdisk", "--clear"]
+    sgdisk_args += ("--new=1:1M:+512M", "--typecode=1:EF00")
+    sgdisk_args.append("--change-name=1:EFI System Partition")
+    zfs_partition = 2
+    if CONFIG.swap_size:
+        sgdisk_args += (f"--new=2:0:+{CONFIG.swap_size}", "--typecode=2:8200")
+        sgdisk_args.append("--change-name=2:Swap")
+        zfs_partition = 3
+    sgdisk_args += (f"--new={zfs_partition}:0:0", f"--typecode={zfs_partition}:BF00")
+    sgdisk_args.append(
+        f"--change-name={zfs_partition}:ZFS Pool {CONFIG.root_pool.name}"
+    )
+    sys_parallel([(*sgdisk_args, str(disk)) for disk in CONFIG.root_pool.disks])
 
     # We sleep here for the kernel to register the new partition layout. I could not
     # find a better way to do this than sleeping. None of "partprobe", "partx",
@@ -359,7 +416,7 @@ def create_zfs_pools_and_file_systems() -> Sequence[Path]:
 
     zfs_create(CONFIG.root_pool, "ROOT", properties={"mountpoint": "none"})
 
-    root_fs_name = f"ROOT/fedora_{''.join(choices(ascii_lowercase + digits, k=6))}"
+    root_fs_name = f"ROOT/fedora_{secrets.token_hex(3)}"
     zfs_create(
         CONFIG.root_pool,
         root_fs_name,
@@ -394,29 +451,25 @@ def setup_efi_partitions_and_install_zfsbootmenu() -> Sequence[str]:
     )
     zfsbootmenu_image = (
         next(Path.cwd().glob("zfsbootmenu-*"))
-        if not CONFIG.dry_mode
+        if not DRY_MODE
         else Path("zbfsbootmenu.efi")
     )
 
-    efi_disk_uuids = []
-    efis_dir = NEW_SYSTEM_ROOT / "boot/efis"
-    for disk in CONFIG.root_pool.disks:
-        sys("mkfs.fat", "-F", "32", "-s", "1", "-n", "EFI", f"{disk}-part1")
-
-        efi_disk_uuid = sys_output(
-            "blkid",
-            *("--match-tag", "UUID"),
-            *("--output", "value"),
-            f"{disk}-part1",
-            dry_mode_output="A48C-0D61",
+    # In dry mode, set up disks one after another so that the logged commands read
+    # like a script instead of being interleaved.
+    with ThreadPoolExecutor(
+        max_workers=(1 if DRY_MODE else len(CONFIG.root_pool.disks))
+    ) as executor:
+        efi_disk_uuids = list(
+            executor.map(
+                lambda disk: _setup_one_efi(disk, zfsbootmenu_image),
+                CONFIG.root_pool.disks,
+            )
         )
-        efi_disk_uuids.append(efi_disk_uuid)
-
-        disk_efi_dir = efis_dir / efi_disk_uuid
-        mkdir(disk_efi_dir)
-        sys("mount", f"{disk}-part1", str(disk_efi_dir))
 
-        copy2(zfsbootmenu_image, disk_efi_dir)
+    # efibootmgr does no locking when choosing the next free boot entry and updating
+    # the boot order, so boot entries must be created one at a time.
+    for disk, efi_disk_uuid in zip(CONFIG.root_pool.disks, efi_disk_uuids):
         sys(
             "efibootmgr",
             "--create",
@@ -429,24 +482,32 @@ def setup_efi_partitions_and_install_zfsbootmenu() -> Sequence[str]:
     return efi_disk_uuids
 
 
-def install_packages(version_id: int) -> None:
-    # For example: "en_US.UTF-8" -> "en".
-    locale_lang = CONFIG.locale[: CONFIG.locale.index("_")]
+def _setup_one_efi(disk: Path, zfsbootmenu_image: Path) -> str:
+    sys("mkfs.fat", "-F", "32", "-s", "1", "-n", "EFI", f"{disk}-part1")
+
+    efi_disk_uuid = sys_output(
+        "blkid",
+        *("--match-tag", "UUID"),
+        *("--output", "value"),
+        f"{disk}-part1",
+        dry_mode_output="A48C-0D61",
+    )
+
+    disk_efi_dir = NEW_SYSTEM_ROOT / "boot/efis" / efi_disk_uuid
+    mkdir(disk_efi_dir)
+    sys("mount", f"{disk}-part1", str(disk_efi_dir))
 
+    copy2(zfsbootmenu_image, disk_efi_dir)
+
+    return efi_disk_uuid
+
+
+def install_packages(version_id: int) -> None:
     # TODO: remove version hacks once official ZFS repos for Fedora 38 are released.
     dnf_install(
         "https://zfsonlinux.org/fedora/"
         f"zfs-release-2-2.fc{min(version_id, 37)}.noarch.rpm",
-        "@core",
-        "kernel",
-        "kernel-devel",
-        "kexec-tools",
-        "efibootmgr",
-        "glibc-minimal-langpack",
-        f"glibc-langpack-{locale_lang}",
-        "zfs",
-        "zfs-dracut",
-        *CONFIG.packages,
+        *NEW_SYSTEM_PACKAGES,
         installroot=NEW_SYSTEM_ROOT,
         releasever=version_id,
     )
@@ -491,31 +552,45 @@ def write_dracut_zfs_conf(pool_key_files: Sequence[Path]) -> None:
     cat_to_file(NEW_SYSTEM_ROOT / "etc/dracut.conf.d/zfs.conf", contents)
 
 
-def write_zfs_mount_generator_cache() -> None:
-    zfs_properties_text = Path(
+def read_zfs_list_cacher_properties() -> str:
+    # Only available after ZFS has been installed to the live environment.
+    zfs_list_cacher_text = Path(
         "/etc/zfs/zed.d/history_event-zfs-list-cacher.sh"
-    ).read_text(encoding="UTF-8")
-    zfs_properties: Optional[str] = None
-    for line in zfs_properties_text.replace("\\\n", "").splitlines():
-        if line.startswith('PROPS="'):
-            zfs_properties = line[len('PROPS="') : -len('"')]
-    if not zfs_properties:
+    ).read_bytes()
+    # If PROPS is assigned multiple times, the last assignment is the one in effect.
+    matches: List[bytes] = ZFS_LIST_CACHER_PROPS_RE.findall(
+        zfs_list_cacher_text.replace(b"\\\n", b"")
+    )
+    if not matches or not matches[-1]:
         raise Exception("Could not determine properties for /etc/zfs/zfs-list.cache")
+    return matches[-1].decode("UTF-8")
+
+
+def write_zfs_mount_generator_cache() -> None:
+    zfs_properties = read_zfs_list_cacher_properties()
 
     zfs_list_cache_dir = NEW_SYSTEM_ROOT / "etc/zfs/zfs-list.cache"
     mkdir(zfs_list_cache_dir)
 
+    # List file systems of all pools at once. The first property is always the name of
+    # the file system, by which we sort the lines into per-pool files.
+    properties_of_pools: Dict[str, List[str]] = {pool.name: [] for pool in CONFIG_POOLS}
+    for line in sys_output(
+        *("zfs", "list", "-H", "-r"),
+        *("-t", "filesystem"),
+        *("-o", zfs_properties),
+        *(pool.name for pool in CONFIG_POOLS),
+        dry_mode_output="\n".join(
+            f"{pool.name}	/	off	on	on	on	on	off	on	off	{pool.name}	"
+            f"prompt	-	-	-	-	-	-	-	-"
+            for pool in CONFIG_POOLS
+        ),
+    ).splitlines():
+        pool_name = line.split("\t", 1)[0].split("/", 1)[0]
+        properties_of_pools[pool_name].append(line)
+
     for pool in CONFIG_POOLS:
-        properties_of_pool = sys_output(
-            *("zfs", "list", "-H", "-r"),
-            *("-t", "filesystem"),
-            *("-o", zfs_properties),
-            pool.name,
-            dry_mode_output=(
-                f"{pool.name}	/	off	on	on	on	on	off	on	off	{pool.name}	"
-                f"prompt	-	-	-	-	-	-	-	-"
-            ),
-        )
+        properties_of_pool = "\n".join(properties_of_pools[pool.name])
         if pool == CONFIG.root_pool:
             # Remove altroot mountpoint that gets prepended to mountpoints by default.
             properties_of_pool = properties_of_pool.replace(
@@ -550,6 +625,8 @@ def run_systemd_firstboot_and_enable_services() -> None:
 
 
 def compile_kernel_dkms_modules_and_generate_initramfs() -> None:
+    # Not run concurrently: DKMS builds the zfs module for every kernel in the same
+    # build directory (/var/lib/dkms/zfs/<version>/build).
     for kernel_version in sys_output(
         "rpm", "--query", "kernel", dry_mode_output="kernel-5.17.5-200.fc35.x86_64"
     ).splitlines():
@@ -559,7 +636,6 @@ def compile_kernel_dkms_modules_and_generate_initramfs() -> None:
 
 
 def setup_users() -> None:
-    passwd("root", CONFIG.root_password)
     for user in CONFIG.users:
         user_home_dir = Path("/home") / user.name
         sys(
@@ -578,7 +654,17 @@ def setup_users() -> None:
         chown(user_home_dir, user.name, user.name, recursive=True)
         chmod(user_home_dir, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
         sys("restorecon", str(user_home_dir))
-        passwd(user.name, user.password, lock_if_empty=False)
+
+    # Set all passwords with a single chpasswd call.
+    passwords = [(user.name, user.password) for user in CONFIG.users if user.password]
+    if CONFIG.root_password:
+        passwords.append(("root", CONFIG.root_password))
+    chpasswd(passwords)
+    if not CONFIG.root_password:
+        sys("passwd", "--lock", "root")
+    for user in CONFIG.users:
+        if not user.password:
+            sys("passwd", user.name, "--delete")
 
 
 # --------------------------------------------------------------------------------------
@@ -598,10 +684,8 @@ def zpool_create(
         chmod(key_file, 0)
 
     zpool_create_args = ["zpool", "create", "-f"]
-    for key, value in pool.pool_properties.items():
-        zpool_create_args += ("-o", f"{key}={value}")
-    for key, value in pool.file_system_properties.items():
-        zpool_create_args += ("-O", f"{key}={value}")
+    zpool_create_args += pool._pool_property_args
+    zpool_create_args += pool._file_system_property_args
     if key_file:
         zpool_create_args += ("-O", "encryption=aes-256-gcm")
         zpool_create_args += ("-O", "keyformat=passphrase")
@@ -644,25 +728,32 @@ def dnf_install(
     if releasever:
         dnf_install_args.append(f"--releasever={releasever}")
     dnf_install_args.extend(args)
+    if installroot:
+        # Reuse the repository metadata that was already downloaded in the live
+        # environment instead of downloading it again for the installroot. This is a
+        # copy and not a bind mount, so that the downloaded packages still go to the
+        # installroot and not to the RAM-backed live environment.
+        installroot_cache_dir = installroot / "var/cache/dnf"
+        mkdir(installroot_cache_dir)
+        sys("cp", "--archive", "/var/cache/dnf/.", str(installroot_cache_dir))
     sys(*dnf_install_args)
 
 
-def passwd(user_name: str, password: str, lock_if_empty: bool = True) -> None:
-    if password:
-        LOGGER.info(f"passwd {user_name} --stdin")
-        if not CONFIG.dry_mode:
-            passwd_proc = subprocess.Popen(
-                ("passwd", user_name, "--stdin"), stdin=subprocess.PIPE
-            )
-            passwd_proc.communicate(password.encode())
-            if passwd_proc.returncode:
-                raise subprocess.CalledProcessError(
-                    passwd_proc.returncode, passwd_proc.args
-                )
-    elif lock_if_empty:
-        sys("passwd", "--lock", "root")
-    else:
-        sys("passwd", user_name, "--delete")
+def chpasswd(passwords: Sequence[Tuple[str, str]]) -> None:
+    if not passwords:
+        return
+    LOGGER.info("chpasswd << EOF")
+    for user_name, _ in passwords:
+        LOGGER.info(f"{user_name}:<password>")
+    LOGGER.info("EOF")
+    if not DRY_MODE:
+        subprocess.run(
+            ("chpasswd",),
+            input="".join(
+                f"{user_name}:{password}\n" for user_name, password in passwords
+            ).encode(),
+            check=True,
+        )
 
 
 @contextmanager
@@ -670,13 +761,16 @@ def chroot(newroot: Path) -> Iterator[None]:
     LOGGER.info(f"chroot {newroot}")
     oldroot_fd = os.open(Path("/"), os.O_PATH)
     try:
-        if not CONFIG.dry_mode:
+        if not DRY_MODE:
+            # The long-lived shell keeps its root, so restart it inside the chroot.
+            close_shell()
             os.chdir(newroot)
             os.chroot(".")
         yield None
     finally:
         LOGGER.info(f"exit  # chroot {newroot}")
-        if not CONFIG.dry_mode:
+        if not DRY_MODE:
+            close_shell()
             os.chdir(oldroot_fd)
             os.chroot(".")
         os.close(oldroot_fd)
@@ -684,47 +778,66 @@ def chroot(newroot: Path) -> Iterator[None]:
 
 def copy2(src: Path, dst: Path) -> None:
     LOGGER.info(f"cp --archive {src} {dst}")
-    if not CONFIG.dry_mode:
+    if not DRY_MODE:
         shutil.copy2(src, dst)
 
 
 def copytree(src: Path, dst: Path) -> None:
     LOGGER.info(f"cp --archive --recursive {src} {dst}")
-    if not CONFIG.dry_mode:
+    if not DRY_MODE:
         shutil.copytree(src, dst, dirs_exist_ok=True)
 
 
 def chown(path: Path, user: str, group: str, recursive: bool = True) -> None:
     LOGGER.info(f"chown {'--recursive' if recursive else ''} {user}:{group} {path}")
-    if not CONFIG.dry_mode:
+    if not DRY_MODE:
+        uid = pwd.getpwnam(user).pw_uid
+        gid = grp.getgrnam(group).gr_gid
+        os.chown(path, uid, gid, follow_symlinks=False)
         if recursive:
-            for p in chain((path,), path.glob("**/*")):
-                shutil.chown(p, user, group)
-        else:
-            shutil.chown(path, user, group)
+            for _, dirnames, filenames, dirfd in os.fwalk(path, follow_symlinks=False):
+                for name in chain(dirnames, filenames):
+                    os.chown(name, uid, gid, dir_fd=dirfd, follow_symlinks=False)
 
 
 def chmod(path: Path, mode: int) -> None:
     LOGGER.info(f"chmod {mode:o} {path} ")
-    if not CONFIG.dry_mode:
+    if not DRY_MODE:
         os.chmod(path, mode)
 
 
 def mkdir(path: Path) -> None:
     LOGGER.info(f"mkdir --parents {path}")
-    if not CONFIG.dry_mode:
-        path.mkdir(parents=True)
+    if not DRY_MODE:
+        os.makedirs(path, exist_ok=True)
+
+
+def mount_rbind(src: Path, dst: Path) -> None:
+    LOGGER.info(f"mount --rbind {src} {dst}")
+    if not DRY_MODE:
+        if LIBC.mount(bytes(src), bytes(dst), None, MS_BIND | MS_REC, None):
+            errno_ = ctypes.get_errno()
+            raise OSError(errno_, os.strerror(errno_), str(dst))
+
+
+def umount_lazy(path: Path) -> None:
+    # A lazy unmount also detaches all mounts below path.
+    LOGGER.info(f"umount --recursive --lazy {path}")
+    if not DRY_MODE:
+        if LIBC.umount2(bytes(path), MNT_DETACH):
+            errno_ = ctypes.get_errno()
+            raise OSError(errno_, os.strerror(errno_), str(path))
 
 
 def rm(path: Path) -> None:
     LOGGER.info(f"rm --force {path}")
-    if not CONFIG.dry_mode:
+    if not DRY_MODE:
         path.unlink(missing_ok=True)
 
 
 def sleep(secs: float) -> None:
     LOGGER.info(f"sleep {secs}")
-    if not CONFIG.dry_mode:
+    if not DRY_MODE:
         time.sleep(secs)
 
 
@@ -733,23 +846,51 @@ def cat_to_file(file: Path, contents: str) -> None:
     for line in contents.splitlines():
         LOGGER.info(line)
     LOGGER.info("EOF")
-    if not CONFIG.dry_mode:
-        file.write_text(contents, encoding="UTF-8")
+    if not DRY_MODE:
+        # Files written here are read right away by other tools (e.g., dracut), so
+        # write them with a single write and fsync them before returning.
+        data = memoryview(contents.encode("UTF-8"))
+        fd = os.open(file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+        try:
+            while data:
+                data = data[os.write(fd, data) :]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
 
 def sys(*args: str, ignore_exit_code: bool = True) -> None:
     LOGGER.info(" ".join(arg if " " not in arg else f'"{arg}"' for arg in args))
-    if not CONFIG.dry_mode:
-        if ignore_exit_code:
-            subprocess.check_call(args)
-        else:
-            subprocess.call(args)
+    if not DRY_MODE:
+        returncode, _ = shell_run(shlex.join(args))
+        if ignore_exit_code and returncode:
+            raise subprocess.CalledProcessError(returncode, args)
+
+
+def sys_parallel(cmds: Sequence[Sequence[str]], ignore_exit_code: bool = True) -> None:
+    # Runs independent commands (e.g., one per disk) concurrently and waits for all of
+    # them, so that the total time is that of the slowest command instead of the sum.
+    for args in cmds:
+        LOGGER.info(" ".join(arg if " " not in arg else f'"{arg}"' for arg in args))
+    if not DRY_MODE and cmds:
+        call = subprocess.check_call if ignore_exit_code else subprocess.call
+        with ThreadPoolExecutor(max_workers=len(cmds)) as executor:
+            futures = [executor.submit(call, args) for args in cmds]
+        # Only raise once all commands have finished, so that none is left running.
+        for future in futures:
+            future.result()
 
 
 def sys_output(*args: str, dry_mode_output: str, shell: bool = False) -> str:
     LOGGER.info(" ".join(arg if " " not in arg else f'"{arg}"' for arg in args))
-    if not CONFIG.dry_mode:
-        output = subprocess.check_output(args, shell=shell).decode()[: -len("\n")]
+    if not DRY_MODE:
+        # Shell snippets run in a subshell so that they can not modify the environment
+        # of the long-lived shell.
+        command = f"({' '.join(args)})" if shell else shlex.join(args)
+        returncode, stdout = shell_run(command, capture_output=True)
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, args, stdout)
+        output = stdout.decode()[: -len("\n")]
     else:
         output = dry_mode_output
     for line in output.splitlines():
@@ -757,5 +898,85 @@ def sys_output(*args: str, dry_mode_output: str, shell: bool = False) -> str:
     return output
 
 
+# Instead of spawning a new process for every command, commands are written to the
+# stdin of a long-lived bash process. After each command, bash writes its exit status
+# in the form "\0<status>\0" to a dedicated pipe (to which also the output of commands
+# is redirected for which we want to capture it). The output of all other commands
+# goes to our stdout/stderr as before.
+
+
+@dataclass
+class _Shell:
+    proc: "subprocess.Popen[bytes]"
+    status_read_fd: int
+    # File descriptor number under which bash sees the write end of the pipe.
+    status_write_fd: int
+
+
+_SHELL: Optional[_Shell] = None
+_SHELL_STATUS_RE = re.compile(rb"\0(\d+)\0\Z")
+
+
+def shell_run(command: str, capture_output: bool = False) -> Tuple[int, bytes]:
+    global _SHELL
+
+    # The long-lived shell can only process one command at a time, so commands from
+    # other threads (e.g., of a ThreadPoolExecutor) are run in their own process.
+    if threading.current_thread() is not threading.main_thread():
+        proc = subprocess.run(
+            ("bash", "-c", command),
+            stdin=subprocess.DEVNULL,
+            stdout=(subprocess.PIPE if capture_output else None),
+        )
+        return proc.returncode, proc.stdout or b""
+
+    if _SHELL is None:
+        status_read_fd, status_write_fd = os.pipe()
+        _SHELL = _Shell(
+            proc=subprocess.Popen(
+                ("bash", "--noprofile", "--norc"),
+                stdin=subprocess.PIPE,
+                bufsize=0,
+                pass_fds=(status_write_fd,),
+            ),
+            status_read_fd=status_read_fd,
+            status_write_fd=status_write_fd,
+        )
+        os.close(status_write_fd)
+
+    assert _SHELL.proc.stdin is not None
+    _SHELL.proc.stdin.write(
+        (
+            f"{{ {command}\n}} </dev/null"
+            + (f" >&{_SHELL.status_write_fd}" if capture_output else "")
+            + f"; printf '\\0%d\\0' \"$?\" >&{_SHELL.status_write_fd}\n"
+        ).encode()
+    )
+
+    data = b""
+    while True:
+        chunk = os.read(_SHELL.status_read_fd, 65536)
+        if not chunk:
+            close_shell()
+            raise RuntimeError(f"Shell exited unexpectedly while running: {command}")
+        data += chunk
+        match = _SHELL_STATUS_RE.search(data)
+        if match:
+            return int(match.group(1)), data[: match.start()]
+
+
+def close_shell() -> None:
+    global _SHELL
+    if _SHELL is not None:
+        assert _SHELL.proc.stdin is not None
+        _SHELL.proc.stdin.close()
+        _SHELL.proc.wait()
+        os.close(_SHELL.status_read_fd)
+        _SHELL = None
+
+
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        close_shell()